@@ -4,6 +4,9 @@ import argparse
 import datetime
 from .caption import Caption
 
+# Output extension for each source image extension (anything else is saved as PNG)
+OUTPUT_EXTENSIONS = {"jpg": "jpg", "jpeg": "jpg", "gif": "gif"}
+
 
 def get_file_name():
     """Generate timestamp-based filename."""
@@ -15,17 +18,10 @@ def parse_color(color_str):
     if not color_str:
         return None
     
-    # Try comma-separated first
-    if ',' in color_str:
-        try:
-            r, g, b = map(int, color_str.split(','))
-            return (r, g, b)
-        except ValueError:
-            pass
-    
-    # Try space-separated
+    # Treat commas as whitespace so both formats go through a single split
+    parts = color_str.replace(',', ' ').split()
     try:
-        r, g, b = map(int, color_str.split())
+        r, g, b = map(int, parts)
         return (r, g, b)
     except ValueError:
         raise ValueError(f"Invalid color format. Use R,G,B or R G B (e.g., '255,255,255')")
@@ -42,7 +38,7 @@ def main():
     parser.add_argument("-f", "--filename", help="Custom output filename (without extension)")
     
     # Font options
-    parser.add_argument("--font", default="arial.ttf", help="Path to font file (default: arial.ttf)")
+    parser.add_argument("--font", help="Path to font file (default: arial.ttf, or Pillow's default font if it isn't installed)")
     
     # Top text options
     parser.add_argument("--top_font_color", help="Top text color as R,G,B or R G B (e.g., '0,0,0' for black)")
@@ -85,7 +81,8 @@ def main():
         caption = Caption(
             img_path, 
             args.text, 
-            font_path=args.font, 
+            font_path=args.font or "arial.ttf",
+            font_fallback=args.font is None,
             separator_line=args.separator_line,
             separator_line_color=separator_color,
             bottom_text=args.bottom_text,
@@ -98,11 +95,9 @@ def main():
         
         # Determine output filename and extension
         out_name = args.filename if args.filename else get_file_name()
-        # Check if image has transparency or if we're using overlay text (no box)
-        # PNG supports transparency better, but we'll let the user specify format eventually
-        is_jpeg = img_path.lower().endswith(('.jpg', '.jpeg'))
-        extension = "jpg" if is_jpeg else "png"
-        extension = "gif" if img_path.lower().endswith(".gif") else "png"
+        # Keep JPEG and GIF sources in their own format, everything else becomes PNG
+        source_ext = os.path.splitext(img_path)[1].lower().lstrip('.')
+        extension = OUTPUT_EXTENSIONS.get(source_ext, "png")
         output_path = f"{out_name}.{extension}"
         
         # Generate and save
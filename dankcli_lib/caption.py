@@ -1,7 +1,216 @@
-from PIL import Image, ImageFont, ImageDraw, ImageSequence
-import math, io, requests
+from PIL import Image, ImageChops, ImageColor, ImageFont, ImageDraw, ImageSequence, UnidentifiedImageError
+import bisect, collections, functools, itertools, math, io, os, re, requests, threading, time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
+# Pillow plugins to try first for common extensions, so opening a local file
+# doesn't have to register and probe every image plugin Pillow ships.
+_FORMATS_BY_EXTENSION = {
+    '.jpg': ('JPEG',),
+    '.jpeg': ('JPEG',),
+    '.png': ('PNG',),
+    '.gif': ('GIF',),
+}
+
+# Wrapped caption text with everything generate() needs to place it
+_TextLayout = collections.namedtuple('_TextLayout', ['lines', 'widths', 'height', 'x'])
+
+@functools.lru_cache(maxsize=64)
+def _default_font(size=None):
+    """Load Pillow's built-in font once per size and share it across captions."""
+    if size is not None:
+        try:
+            # Pillow 10.1+ ships a scalable default font
+            return ImageFont.load_default(size=size)
+        except TypeError:
+            pass
+    return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=64)
+def _load_font(path, size, layout_engine=None):
+    """Load a TrueType font, sharing one instance per (path, size, layout_engine) across captions."""
+    return ImageFont.truetype(path, size=size, layout_engine=layout_engine)
+
+def _needs_shaping(text):
+    """Whether text reaches scripts (Hebrew, Arabic, Indic, emoji, ...) that need Raqm's complex shaping."""
+    # Latin, Greek and Cyrillic all sit below U+0590 and lay out correctly
+    # with Pillow's basic engine
+    return any(ord(ch) >= 0x0590 for ch in text)
+
+# Bodies of recently downloaded images for Caption(..., cache_url=True), by
+# URL: (fresh_until, etag, last_modified, body). Oldest entries are evicted
+# first; the lock guards it across Caption.from_urls' download threads.
+_URL_CACHE_SIZE = 32
+_url_cache = collections.OrderedDict()
+_url_cache_lock = threading.Lock()
+
+def _download(url, session=requests, cache=False):
+    """Download url into a BytesIO, copying the body in chunks instead of materializing response.content."""
+    headers = {}
+    cached = None
+    if cache:
+        with _url_cache_lock:
+            cached = _url_cache.get(url)
+            if cached:
+                _url_cache.move_to_end(url)
+        if cached:
+            fresh_until, etag, last_modified, body = cached
+            if time.monotonic() < fresh_until:
+                return io.BytesIO(body)
+            # Stale: revalidate, the server answers 304 if it hasn't changed
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+    data = io.BytesIO()
+    with session.get(url, stream=True, headers=headers) as response:
+        if cached and response.status_code == 304:
+            body = cached[3]
+        else:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                data.write(chunk)
+            body = None
+        response_headers = response.headers
+
+    if cache:
+        cache_control = response_headers.get('Cache-Control', '').lower()
+        if 'no-store' not in cache_control:
+            max_age = re.search(r'max-age=(\d+)', cache_control)
+            fresh_until = 0  # revalidate on every use
+            if max_age and 'no-cache' not in cache_control:
+                fresh_until = time.monotonic() + int(max_age.group(1))
+            etag = response_headers.get('ETag', cached[1] if cached else None)
+            last_modified = response_headers.get('Last-Modified', cached[2] if cached else None)
+            entry = (fresh_until, etag, last_modified, body if body is not None else data.getvalue())
+            with _url_cache_lock:
+                _url_cache[url] = entry
+                _url_cache.move_to_end(url)
+                while len(_url_cache) > _URL_CACHE_SIZE:
+                    _url_cache.popitem(last=False)
+
+    if body is not None:
+        return io.BytesIO(body)
+    data.seek(0)
+    return data
+
+@functools.lru_cache(maxsize=4096)
+def _measure(font, text):
+    """Return the (width, height) of text's bounding box, shared by every caption using font."""
+    bbox = font.getbbox(text)
+    return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+@functools.lru_cache(maxsize=4096)
+def _advance(font, text):
+    """Return the advance width of text, so repeated words are only shaped once."""
+    return font.getlength(text)
+
+@functools.lru_cache(maxsize=32)
+def _render_text_mask(font, lines, widths, pitch, bold, italic):
+    """
+    Rasterize centered lines of text into an "L" coverage mask with bold/italic simulation.
+
+    Each line is drawn on its own at a precomputed x from its known width and
+    a fixed line pitch, so Pillow doesn't re-measure lines to align them.
+    The mask only depends on the font, text and style, so captions that reuse
+    the same text (GIF frames, batches of images) rasterize it once and then
+    just composite it in any color. Returns (mask, (pad_x, pad_y)), where the
+    padding is the offset of the text origin inside the mask.
+    """
+    max_width = max(widths)
+    pad = 2
+    height = math.ceil(len(lines) * pitch) + 2 * pad
+    # Shearing slants lower rows to the left, leave room so they aren't clipped
+    slant = math.ceil(0.2 * height) if italic else 0
+    mask = Image.new("L", (math.ceil(max_width) + slant + 2 * pad, height), 0)
+    draw = ImageDraw.Draw(mask)
+    for index, (line, width) in enumerate(zip(lines, widths)):
+        x = slant + pad + (max_width - width) / 2
+        y = pad + index * pitch
+        draw.text((x, y), line, fill=255, font=font)
+
+    if bold:
+        # Simulate bold by overlaying the text on itself shifted 1px right,
+        # down and diagonally. Screen blends coverage exactly like drawing
+        # the text again with fill=255, but rasterizes the glyphs only once.
+        # Cropping past the top/left edge shifts in blank pixels (offset()
+        # would wrap ink back around from the other side).
+        w, h = mask.size
+        shifted = ImageChops.screen(mask, mask.crop((-1, 0, w - 1, h)))
+        mask = ImageChops.screen(shifted, shifted.crop((0, -1, w, h - 1)))
+
+    if italic:
+        # Simulate italic text by shearing (0.2 = ~11 degrees slant)
+        mask = mask.transform(
+            mask.size,
+            Image.Transform.AFFINE,
+            (1, 0.2, 0, 0, 1, 0),
+            Image.Resampling.BILINEAR
+        )
+
+    return mask, (slant + pad, pad)
+
+def _gray_level(color):
+    """Return the gray level of an opaque gray RGB(A) tuple or color string, else None."""
+    if isinstance(color, str):
+        color = ImageColor.getrgb(color)
+    if not isinstance(color, (tuple, list)) or len(color) not in (3, 4):
+        return None
+    r, g, b = color[:3]
+    if r == g == b and (len(color) == 3 or color[3] == 255):
+        return r
+    return None
+
+@functools.lru_cache(maxsize=2048)
+def _wrap_words(font, text, limit):
+    """
+    Wrap text into lines narrower than limit, returning (lines, line_widths) tuples.
+
+    Cached on (font, text, limit), so re-rendering a caption, or captioning
+    several images of the same width with the same text, wraps it only once.
+    """
+    # Most captions fit on one line, skip splitting and measuring word by word
+    text_width = _advance(font, text)
+    if text_width < limit:
+        return (text.strip(),), (text_width,)
+
+    lines = []
+    widths = []
+    words = text.split(' ')
+
+    # Measure each word (and the space between words) once, then find the
+    # line breaks with a binary search over the running total of advances
+    # instead of re-measuring every growing line prefix.
+    space_width = _advance(font, " ")
+    offsets = [0]
+    offsets.extend(itertools.accumulate(_advance(font, word) + space_width for word in words))
+
+    start = 0
+    for end in _line_breaks(offsets, space_width, limit):
+        lines.append(' '.join(words[start:end]).strip())
+        widths.append(offsets[end] - offsets[start] - space_width)
+        start = end
+
+    return tuple(lines), tuple(widths)
+
+def _line_breaks(offsets, space_width, limit):
+    """
+    Yield the end index of each wrapped line.
+
+    offsets[i] is the summed advance (word width plus one space) of the
+    first i words, so offsets[end] - offsets[start] - space_width is the
+    width of words[start:end] joined by single spaces.
+    """
+    count = len(offsets) - 1
+    start = 0
+    while start < count:
+        end = bisect.bisect_left(offsets, offsets[start] + space_width + limit) - 1
+        # A word wider than the limit still gets a line of its own
+        end = max(end, start + 1)
+        yield end
+        start = end
+
 class Caption:
     """Handles image captioning with text overlay."""
     
@@ -23,14 +232,15 @@ class Caption:
     
     def __init__(self, image_path, text, separator_line=False, separator_line_color=None, 
                  bottom_text=None, bottom_text_box=True,
-                 top_font_color=None, bottom_font_color=None, top_background_color=None, bottom_background_color=None, italic=False, bold=False):
+                 top_font_color=None, bottom_font_color=None, top_background_color=None, bottom_background_color=None, italic=False, bold=False,
+                 font_path=None, target_width=None, cache_url=False, font_fallback=False):
         """
         Initialize Caption with an image and text.
         
         Args:
-            image_path: Path to the source image
+            image_path: Path or http(s) URL of the source image, or a binary file-like object
             text: Caption text (supports \\n for newlines)
-            font_path: Path to font file (defaults to arial.ttf)
+            font_path: Path to a TrueType font file (defaults to Pillow's built-in font)
             separator_line: Whether to draw a black line between text and image
             bottom_text: Optional text to place at the bottom of the image
             bottom_text_box: If True, adds white box for bottom text. If False, overlays text on image
@@ -38,15 +248,42 @@ class Caption:
             bottom_font_color: Font color for bottom text (defaults to white (255,255,255) if None)
             italic: Whether Text should be Italic
             bold: Whether Text should be Bold
+            target_width: Optional width hint; JPEG sources at least twice as wide are
+                decoded at a reduced DCT scale that is still at least this wide
+            cache_url: Keep the downloaded bytes of a URL source in a small in-memory
+                cache, reused while fresh (max-age) and revalidated with ETag /
+                Last-Modified once stale
+            font_fallback: If font_path can't be loaded, use Pillow's default font at the
+                computed size instead of raising OSError
         """
         #self.image = Image.open(image_path)
-        parsed = urlparse(image_path)
-        if parsed.scheme in ('http', 'https'):
-            response = requests.get(image_path, stream=True)
-            response.raise_for_status()
-            self.image = Image.open(io.BytesIO(response.content))
-        else:
+        if hasattr(image_path, 'read'):
+            # Already-loaded bytes, e.g. from Caption.from_urls
             self.image = Image.open(image_path)
+        elif urlparse(image_path).scheme in ('http', 'https'):
+            self.image = Image.open(_download(image_path, cache=cache_url))
+        else:
+            # One sequential read instead of letting Pillow seek around the file
+            with open(image_path, 'rb') as f:
+                data = io.BytesIO(f.read())
+
+            formats = _FORMATS_BY_EXTENSION.get(os.path.splitext(image_path)[1].lower())
+            try:
+                self.image = Image.open(data, formats=formats)
+            except UnidentifiedImageError:
+                # The extension doesn't match the contents, probe every plugin
+                if formats is None:
+                    raise
+                data.seek(0)
+                self.image = Image.open(data)
+
+        # Only the header has been parsed at this point; the pixels are decoded
+        # (once, Pillow keeps them) the first time generate() pastes the image.
+        if target_width and self.image.format == 'JPEG' and self.image.width >= 2 * target_width:
+            # libjpeg scales down by 1/2, 1/4 or 1/8 while decoding, far cheaper
+            # than decoding at full size and resizing afterwards.
+            target_height = -(-self.image.height * target_width // self.image.width)
+            self.image.draft(self.image.mode, (target_width, target_height))
             
         self.text = text.replace("\\n", "\n")
         self.bottom_text = bottom_text.replace("\\n", "\n") if bottom_text else None
@@ -65,28 +302,90 @@ class Caption:
         self.top_background_color = top_background_color if top_background_color is not None else (255, 255, 255)
         self.bottom_background_color = bottom_background_color if bottom_background_color is not None else (255, 255, 255)
         
+        # Captioned image, rendered on the first generate()
+        self._rendered = None
+        self._converted = None
+
         # Initialize font
-        self.font = ImageFont.load_default()
+        if font_path:
+            # Raqm/HarfBuzz shaping is much slower than the basic layout
+            # engine and buys nothing for plain Latin captions
+            if _needs_shaping(self.text + (self.bottom_text or "")):
+                layout_engine = None
+            else:
+                layout_engine = ImageFont.Layout.BASIC
+            font_size = self._calculate_font_size()
+            try:
+                self.font = _load_font(font_path, font_size, layout_engine)
+            except OSError:
+                # Missing or unreadable font file (e.g. arial.ttf off Windows)
+                if not font_fallback:
+                    raise
+                self.font = _default_font(font_size)
+        else:
+            self.font = _default_font()
+        # Line height depends only on the font, so take it from the font's
+        # metrics once (bitmap fonts have none, measure ascenders+descenders).
+        if hasattr(self.font, "getmetrics"):
+            ascent, descent = self.font.getmetrics()
+            self._line_height = ascent + descent
+        else:
+            _, self._line_height = self._get_text_dimensions("Hg")
+        self._line_pitch = self._line_height * 1.2
+        self._v_padding = self.TOP_PADDING + self.BOTTOM_PADDING
+
+    @classmethod
+    def from_urls(cls, urls_and_texts, max_workers=8, **kwargs):
+        """
+        Build captions for several image URLs, downloading them concurrently.
+
+        Args:
+            urls_and_texts: Iterable of (url, text) pairs
+            max_workers: Maximum number of simultaneous downloads
+            **kwargs: Extra Caption arguments applied to every caption
+
+        Returns:
+            list[Caption]: One caption per pair, in the same order
+        """
+        pairs = list(urls_and_texts)
+        with requests.Session() as session:
+            # Keep-alive pool sized so every worker can hold a connection
+            adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            cache = kwargs.get('cache_url', False)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                buffers = list(executor.map(lambda pair: _download(pair[0], session, cache), pairs))
+        return [cls(buffer, text, **kwargs) for buffer, (_, text) in zip(buffers, pairs)]
 
     def _is_animated_gif(self):
         """Check if the image is an animated GIF."""
-        return (hasattr(self.image, 'is_animated') and 
-                self.image.is_animated and 
-                getattr(self.image, 'format', '') == 'GIF')
+        # The format is known from the header; only GIFs get their frames probed
+        return (getattr(self.image, 'format', '') == 'GIF' and
+                getattr(self.image, 'is_animated', False))
 
     def compress_to_size(self, buffer, target_size=8*1000*1000, original_format=None):
-        """Compress image to fit under target size (default 8MB)"""
-        # Check current size
-        buffer.seek(0, 2)
-        current_size = buffer.tell()
-        buffer.seek(0)
-        
-        
-        if current_size <= target_size:
-            return buffer
-        
-        # Open image from buffer
-        img = Image.open(buffer)
+        """
+        Compress image to fit under target size (default 8MB)
+
+        buffer is either an encoded image in a file-like object, returned as is
+        if it already fits, or a PIL Image, which is compressed straight away
+        without being encoded and decoded again first.
+        """
+        if isinstance(buffer, Image.Image):
+            img = buffer
+        else:
+            # Check current size
+            buffer.seek(0, 2)
+            current_size = buffer.tell()
+            buffer.seek(0)
+            
+            
+            if current_size <= target_size:
+                return buffer
+            
+            # Open image from buffer
+            img = Image.open(buffer)
         
         # Determine format
         if original_format:
@@ -140,11 +439,18 @@ class Caption:
                 output.seek(0)
                 return output
 
-        # If quality reduction failed, aggressive resize
+        # If quality reduction failed, aggressive resize. thumbnail() shrinks
+        # img in place (reducing by whole factors before the Lanczos pass),
+        # so each step starts from the already smaller image; give up after
+        # four steps rather than shrinking towards zero. Work on a copy so a
+        # caller's image (e.g. the cached render) is left untouched.
+        img = img.copy()
         scale = 0.7 
-        while output.tell() > target_size:
-            new_size = (int(img.width * scale), int(img.height * scale))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
+        for _ in range(4):
+            if output.tell() <= target_size:
+                break
+            new_size = (max(int(img.width * scale), 1), max(int(img.height * scale), 1))
+            img.thumbnail(new_size, Image.Resampling.LANCZOS)
             output.seek(0)
             output.truncate()
             img.save(output, format='JPEG', quality=50, optimize=True)
@@ -156,79 +462,134 @@ class Caption:
     def _compress_gif(self, img, target_size):
         """Compresses GIF by reducing colors and resolution until it fits target_size."""
         
-        # Start with current resolution or cap at 800px
+        # Start with current resolution or cap at 800px, drop colors first to
+        # preserve sharpness, then drop resolution 100px at a time
         current_width = min(img.width, 800)
-        colors = 256 # Start with max colors
-        
-        while True:
-            scale = current_width / float(img.width)
-            new_size = (current_width, int(float(img.height) * scale))
-            
-            frames = []
-            durations = []
-            
-            for frame in ImageSequence.Iterator(img):
-                # 1. Resize
-                f = frame.resize(new_size, Image.Resampling.BILINEAR)
-                # 2. Reduce Quality (Quantize colors)
-                f = f.convert("P", palette=Image.Palette.ADAPTIVE, colors=colors)
-                frames.append(f)
-                durations.append(frame.info.get('duration', 100))
-            
-            output = io.BytesIO()
-            frames[0].save(
-                output, format='GIF', save_all=True, append_images=frames[1:],
-                duration=durations, loop=0, optimize=True, disposal=2
-            )
-            
-            output.seek(0, 2)
-            final_size = output.tell()
+        ladder = [(current_width, 256), (current_width, 128), (current_width, 64)]
+        while current_width > 200:
+            current_width -= 100
+            ladder.append((current_width, 64))
+
+        # Decode every frame once; the attempts below only resize and quantize
+        sources = []
+        durations = []
+        for frame in ImageSequence.Iterator(img):
+            sources.append(frame.convert("RGB"))
+            durations.append(frame.info.get('duration', 100))
+
+        resized = []
+        resized_width = None
+
+        def encode(step, frames, output):
+            nonlocal resized, resized_width
+            width, colors = ladder[step]
+            if width != resized_width or len(resized) < len(frames):
+                # Only keep one width's frames alive next to the sources;
+                # drop the old ones before resizing for the new width
+                resized = []
+                resized = self._resize_gif_frames(frames, img.size, width)
+                resized_width = width
+            self._encode_gif(resized[:len(frames)], durations[:len(frames)], colors, output)
+            return output.tell()
+
+        # One full encode at the best quality, which also tells us how the
+        # whole animation compares to its first frame
+        output = io.BytesIO()
+        final_size = encode(0, sources, output)
+        if final_size <= target_size:
             output.seek(0)
-            
-            
-            # Check if we are under the limit
-            if final_size <= target_size:
-                return output
-            
-            # If still too big, get more aggressive
-            if colors > 64:
-                colors //= 2  # Drop colors first to preserve sharpness
-            elif current_width > 200:
-                current_width -= 100 # Then drop resolution
+            return output
+        ratio = final_size / encode(0, sources[:1], io.BytesIO())
+
+        # Probing a step costs one frame, not the whole animation: binary
+        # search the ladder for the best step whose estimate fits
+        lo, hi = 1, len(ladder) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if encode(mid, sources[:1], io.BytesIO()) * ratio <= target_size:
+                hi = mid
             else:
-                # If still too big at tiny res/colors, skip frames
-                return output
+                lo = mid + 1
+
+        # The estimate can miss: an underestimate is caught here by moving
+        # down the ladder until a full encode fits, but an overestimate may
+        # already have skipped a better step that would have fitted
+        for step in range(lo, len(ladder)):
+            output.seek(0)
+            output.truncate()
+            if encode(step, sources, output) <= target_size:
+                break
+        # If still too big at tiny res/colors, return the smallest attempt
+        output.seek(0)
+        return output
+
+    def _resize_gif_frames(self, frames, size, width):
+        """Resize RGB frames of the given source size to width, keeping the aspect ratio."""
+        scale = width / float(size[0])
+        new_size = (width, int(float(size[1]) * scale))
+        # At half size or less a box filter (each source pixel averaged
+        # once) looks the same after quantization and is cheaper
+        if width <= size[0] // 2:
+            resample = Image.Resampling.BOX
+        else:
+            resample = Image.Resampling.BILINEAR
+        return [frame.resize(new_size, resample) for frame in frames]
+
+    def _palette_sample(self, frames, budget=512 * 512):
+        """Stack a downscaled copy of every frame into one image of about budget pixels."""
+        width, height = frames[0].size
+        scale = min(1.0, math.sqrt(budget / len(frames) / (width * height)))
+        tile = (max(int(width * scale), 1), max(int(height * scale), 1))
+        if len(frames) == 1 and tile == frames[0].size:
+            return frames[0]
+        sample = Image.new("RGB", (tile[0], tile[1] * len(frames)))
+        for index, frame in enumerate(frames):
+            sample.paste(frame.resize(tile, Image.Resampling.BOX), (0, index * tile[1]))
+        return sample
+
+    def _encode_gif(self, frames, durations, colors, output):
+        """Quantize RGB frames to one shared adaptive palette and write them to output as a GIF."""
+        # Median cut is the slow part, so run it once on a small sample of
+        # every frame (colours that only show up in later frames still get
+        # palette entries) and map each frame onto that palette. No
+        # dithering: the noise it adds roughly triples the LZW output, which
+        # defeats squeezing the GIF under a size limit.
+        master = self._palette_sample(frames).quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+        quantized = [
+            frame.quantize(palette=master, dither=Image.Dither.NONE) for frame in frames
+        ]
+        quantized[0].save(
+            output, format='GIF', save_all=True, append_images=quantized[1:],
+            duration=durations, loop=0, optimize=True, disposal=2
+        )
 
     def generate_gif(self):
         """Generate captioned GIF preserving animation."""
-        frames = []
+        # Decoding has to walk the frames in order, but once each frame is
+        # its own RGB image the captioning is independent and Pillow drops
+        # the GIL while it pastes and draws, so render the frames on threads.
+        sources = []
         durations = []
-        
-        # Process each frame
         for frame in ImageSequence.Iterator(self.image):
-            # Convert frame to RGB and copy
-            frame_rgb = frame.convert('RGB')
-            
-            # Temporarily replace self.image with current frame
-            original_image = self.image
-            original_size = (self.width, self.height)
-            
-            self.image = frame_rgb
-            self.width, self.height = self.image.size
-            
-            # Generate captioned frame
-            captioned_frame = self.generate()
-            frames.append(captioned_frame)
-            
-            # Get frame duration
-            try:
-                durations.append(frame.info.get('duration', 100))
-            except:
-                durations.append(100)
-        
-        # Restore original image
-        self.image = original_image
-        self.width, self.height = original_size
+            sources.append(frame.convert('RGB'))
+            durations.append(frame.info.get('duration', 100))
+
+        # The caption strips are the same for every frame of a given size:
+        # lay out and draw them once, then each frame only copies the canvas
+        # and pastes its own pixels in.
+        templates = {}
+        for source in sources:
+            if source.size not in templates:
+                templates[source.size] = self._caption_canvas("RGB", *source.size)
+
+        def caption_frame(source):
+            template, top, bottom = templates[source.size]
+            canvas = template.copy()
+            self._composite(canvas, source, "RGB", top, bottom)
+            return canvas
+
+        with ThreadPoolExecutor(max_workers=min(len(sources), os.cpu_count() or 1)) as executor:
+            frames = list(executor.map(caption_frame, sources))
         
         # Save as animated GIF
         output = io.BytesIO()
@@ -244,298 +605,212 @@ class Caption:
         output.seek(0)
         return output
     
-    def _draw_text_with_style(self, draw, position, text, fill, align="center", spacing=4):
-        """Draw text with bold/italic simulation"""
-        x, y = position
-        
-        if self.bold and self.italic:
-            # Bold Italic: draw multiple times with offset + shear
-            self._draw_bold_italic_text(draw, position, text, fill, align, spacing+4)
-        elif self.bold:
-            # Bold: draw text multiple times with slight offset
-            offsets = [(0,0), (1,0), (0,1), (1,1)]
-            for dx, dy in offsets:
-                draw.multiline_text(
-                    (x + dx, y + dy),
-                    text,
-                    fill=fill,
-                    font=self.font,
-                    align=align,
-                    spacing=spacing+4
-                )
-        elif self.italic:
-            # Italic: draw with shear effect
-            self._draw_italic_text(draw, position, text, fill, align, spacing)
-        else:
-            # Normal
-            draw.multiline_text(
-                position,
-                text,
-                fill=fill,
-                font=self.font,
-                align=align,
-                spacing=spacing
-            )
-
-    def _draw_italic_text(self, draw, position, text, fill, align="center", spacing=4):
-        """Simulate italic text by shearing"""
-        from PIL import Image
-        
-        # Get text size
-        bbox = draw.textbbox((0, 0), text, font=self.font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        
-        # Create temp image for text
-        temp_img = Image.new('RGBA', (text_width + 20, text_height + 20), (0, 0, 0, 0))
-        temp_draw = ImageDraw.Draw(temp_img)
-        temp_draw.text((10, 10), text, fill=fill, font=self.font, align=align, spacing=spacing)
-        
-        # Apply shear transformation (0.2 = ~11 degrees slant)
-        temp_img = temp_img.transform(
-            temp_img.size,
-            Image.Transform.AFFINE,
-            (1, 0.2, 0, 0, 1, 0),
-            Image.Resampling.BILINEAR
+    def _text_mask(self, layout):
+        """Return the cached glyph mask and its padding for a text layout."""
+        return _render_text_mask(
+            self.font, layout.lines, layout.widths, self._line_pitch, self.bold, self.italic
         )
-        
-        # Paste onto main canvas
-        draw._image.paste(temp_img, (int(position[0] - 10), int(position[1] - 10)), temp_img)
 
-    def _draw_bold_italic_text(self, draw, position, text, fill, align="center", spacing=4):
-        """Simulate bold italic text"""
-        from PIL import Image
-        
-        # Get text size
-        bbox = draw.textbbox((0, 0), text, font=self.font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        
-        # Create temp image
-        temp_img = Image.new('RGBA', (text_width + 30, text_height + 30), (0, 0, 0, 0))
-        temp_draw = ImageDraw.Draw(temp_img)
-        
-        # Draw multiple times for bold
-        offsets = [(0,0), (1,0), (0,1), (1,1)]
-        x, y = 15, 15
-        for dx, dy in offsets:
-            temp_draw.text((x + dx, y + dy), text, fill=fill, font=self.font, align=align, spacing=spacing)
-        
-        # Apply shear for italic
-        temp_img = temp_img.transform(
-            temp_img.size,
-            Image.Transform.AFFINE,
-            (1, 0.2, 0, 0, 1, 0),
-            Image.Resampling.BILINEAR
-        )
-        
-        # Paste
-        draw._image.paste(temp_img, (int(position[0] - 15), int(position[1] - 15)), temp_img)
+    def _draw_text_with_style(self, canvas, position, layout, fill):
+        """Draw laid-out text with bold/italic simulation by compositing its cached glyph mask"""
+        mask, (pad_x, pad_y) = self._text_mask(layout)
+        x, y = position
+        canvas.paste(fill, (round(x) - pad_x, round(y) - pad_y), mask)
 
     def _calculate_font_size(self):
         """Calculate appropriate font size based on image dimensions."""
-        temp_size = max(math.floor(self.height / 13), self.MINIMUM_FONT_SIZE)
+        temp_size = max(self.height // 13, self.MINIMUM_FONT_SIZE)
         
-        # Scale down for very tall images
-        if self.height / self.width >= self.HW_ASPECT_RATIO_THRESHOLD:
-            return math.floor(temp_size / 1.5)
+        # Scale down for very tall images (integer math: size / 1.5 == size * 2 // 3)
+        if self.height >= self.width * self.HW_ASPECT_RATIO_THRESHOLD:
+            return temp_size * 2 // 3
         return temp_size
     
     def _get_text_dimensions(self, text):
         """Get width and height of text with current font."""
-        bbox = self.font.getbbox(text)
-        return bbox[2] - bbox[0], bbox[3] - bbox[1]
+        return _measure(self.font, text)
     
     def _wrap_text(self, text, max_width):
-        """Wrap text to fit within max_width."""
-        lines = []
-        words = text.split(' ')
-        i = 0
-        
-        while i < len(words):
-            line = ''
-            while (i < len(words) and 
-                   self._get_text_dimensions(line + words[i])[0] < max_width - self.WIDTH_PADDING):
-                line = line + words[i] + " "
-                i += 1
-            
-            if not line:
-                line = words[i]
-                i += 1
-            
-            lines.append(line.strip())
-        
-        return '\n'.join(lines)
+        """Wrap text to fit within max_width, returning (lines, line_widths)."""
+        lines, widths = _wrap_words(self.font, text, max_width - self.WIDTH_PADDING)
+        return list(lines), list(widths)
     
-    def _process_text(self):
-        """Process and wrap text for rendering."""
-        wrapped_lines = "\n".join([
-            self._wrap_text(line, self.width) 
-            for line in self.text.split("\n")
-        ])
-        return wrapped_lines
+    def _process_text(self, text, width):
+        """Wrap every paragraph of text, returning flat (lines, line_widths) lists."""
+        wrapped_lines = []
+        line_widths = []
+        for line in text.split("\n"):
+            lines, widths = self._wrap_text(line, width)
+            wrapped_lines.extend(lines)
+            line_widths.extend(widths)
+        return wrapped_lines, line_widths
     
-    def _calculate_text_height(self, text):
-        """Calculate total height needed for text."""
-        line_list = text.split('\n')
-        if not line_list:
+    def _calculate_text_height(self, lines):
+        """Calculate total height needed for the wrapped lines."""
+        if not lines:
             return 0
         
-        _, line_height = self._get_text_dimensions(line_list[0])
-        total_text_height = len(line_list) * (line_height * 1.2)
-        return int(total_text_height + self.TOP_PADDING + self.BOTTOM_PADDING)
-    
-    def _get_text_position(self, text):
-        """Calculate top-left corner position for centered text."""
-        line_list = text.split('\n')
-        max_w = max(self._get_text_dimensions(line)[0] for line in line_list)
-        return ((self.width - max_w) / 2, self.TOP_PADDING)
+        return int(len(lines) * self._line_pitch + self._v_padding)
     
-    def _get_text_position_bottom(self, text, y_offset):
-        """Calculate top-left corner position for centered bottom text."""
-        line_list = text.split('\n')
-        max_w = max(self._get_text_dimensions(line)[0] for line in line_list)
-        return ((self.width - max_w) / 2, y_offset + self.TOP_PADDING)
+    def _layout(self, text, width):
+        """Wrap, measure and horizontally center text in a single pass."""
+        lines, widths = self._process_text(text, width)
+        return _TextLayout(
+            lines=tuple(lines),
+            widths=tuple(widths),
+            height=self._calculate_text_height(lines),
+            x=(width - max(widths)) / 2,
+        )
     
-    def _get_text_position_bottom_overlay(self, text):
-        """Calculate position for bottom text overlay on the image."""
-        line_list = text.split('\n')
-        max_w = max(self._get_text_dimensions(line)[0] for line in line_list)
-        
-        _, line_height = self._get_text_dimensions(line_list[0])
-        total_text_height = len(line_list) * (line_height * 1.2)
+    def _get_text_position_bottom_overlay(self, layout, height):
+        """Calculate position for bottom text overlay on an image of the given height."""
+        total_text_height = len(layout.lines) * self._line_pitch
         
-        y_position = self.height - total_text_height - self.BOTTOM_PADDING
+        y_position = height - total_text_height - self.BOTTOM_PADDING
         
         if y_position < self.TOP_PADDING:
             y_position = self.TOP_PADDING
             
-        return ((self.width - max_w) / 2, y_position)
+        return (layout.x, y_position)
     
+    def _canvas_mode(self):
+        """Use a single-channel canvas when the source and every caption color are gray."""
+        if self.image.mode != "L":
+            return "RGB"
+        colors = (self.top_font_color, self.bottom_font_color, self.top_background_color,
+                  self.bottom_background_color, self.separator_line_color)
+        return "L" if all(_gray_level(color) is not None for color in colors) else "RGB"
+
+    def _source_for(self, mode):
+        """Return self.image in a mode the canvas can paste without a per-pixel convert."""
+        image = self.image
+        # RGBA pastes straight into RGB; anything else (P, LA, CMYK, ...) is
+        # converted once and kept for later renders of the same source.
+        if image.mode == mode or (mode == "RGB" and image.mode == "RGBA"):
+            return image
+        if self._converted is None or self._converted[0] is not image or self._converted[1].mode != mode:
+            self._converted = (image, image.convert(mode))
+        return self._converted[1]
+
+    def _canvas_color(self, color, mode):
+        """Convert a caption color to a fill value for a canvas of the given mode."""
+        return _gray_level(color) if mode == "L" else color
+
     def generate(self):
         """
         Generate the captioned image.
+
+        The result is cached, so repeated save()/to_buffer() calls don't
+        re-render it; treat the returned image as read-only.
         
         Returns:
             PIL.Image: The captioned image
         """
-        wrapped_top_text = self._process_text()
-        top_text_height = self._calculate_text_height(wrapped_top_text)
+        if self._rendered is None:
+            self._rendered = self._render()
+        return self._rendered
+
+    def _render(self):
+        """Render the captioned canvas for self.image."""
+        mode = self._canvas_mode()
+        source = self._source_for(mode)
+        canvas, top, bottom = self._caption_canvas(mode, *source.size)
+        self._composite(canvas, source, mode, top, bottom)
+        return canvas
+
+    def _caption_canvas(self, mode, width, height):
+        """
+        Build a canvas with the caption strips and their text for an image of the given size.
+
+        The image area is left uninitialized for _composite() to fill in, so
+        GIF frames of the same size can share one caption canvas. Returns
+        (canvas, top_layout, bottom_layout or None).
+        """
+        top = self._layout(self.text, width)
+        top_text_height = top.height
         
         bottom_text_height = 0
-        wrapped_bottom_text = None
+        bottom = None
         if self.bottom_text:
-            wrapped_bottom_text = "\n".join([
-                self._wrap_text(line, self.width) 
-                for line in self.bottom_text.split("\n")
-            ])
-            bottom_text_height = self._calculate_text_height(wrapped_bottom_text)
-            
-            if self.bottom_text_box:
-                max_allowed_height = int(self.height * self.MAX_BOTTOM_TEXT_HEIGHT_RATIO)
-                if bottom_text_height > max_allowed_height:
-                    pass
+            bottom = self._layout(self.bottom_text, width)
+            bottom_text_height = bottom.height
         
         if self.bottom_text_box or not self.bottom_text:
-            total_height = top_text_height + self.height + bottom_text_height
-            canvas = Image.new("RGB", (self.width, total_height), (255, 255, 255))
-            canvas.paste(self.image, (0, top_text_height))
+            total_height = top_text_height + height + bottom_text_height
         else:
-            total_height = top_text_height + self.height
-            canvas = Image.new("RGB", (self.width, total_height), (255, 255, 255))
-            canvas.paste(self.image, (0, top_text_height))
-        
-        draw = ImageDraw.Draw(canvas)
-        
-        if self.top_background_color:
-            draw.rectangle(
-                [(0, 0), (self.width, top_text_height)],
-                fill=self.top_background_color
+            total_height = top_text_height + height
+
+        # Every pixel is covered by a caption strip or the source image below,
+        # so skip initializing the canvas instead of filling it with white
+        # only to overwrite the image area straight away. Grayscale sources
+        # with gray captions stay single-channel, a third of the RGB traffic.
+        canvas = Image.new(mode, (width, total_height), None)
+        canvas.paste(self._canvas_color(self.top_background_color, mode), (0, 0, width, top_text_height))
+        if bottom and self.bottom_text_box:
+            bottom_bg_y = top_text_height + height
+            canvas.paste(self._canvas_color(self.bottom_background_color, mode), (0, bottom_bg_y, width, total_height))
+
+        # Caption text stays inside its strip's padding, so it can be drawn
+        # before the image is pasted
+        self._draw_text_with_style(
+            canvas,
+            (top.x, self.TOP_PADDING),
+            top,
+            fill=self._canvas_color(self.top_font_color, mode)
+        )
+
+        if bottom and self.bottom_text_box:
+            bottom_text_pos = (bottom.x, top_text_height + height + self.TOP_PADDING)
+
+            self._draw_text_with_style(
+                canvas,
+                bottom_text_pos,
+                bottom,
+                fill=self._canvas_color(self.bottom_font_color, mode)
             )
         
+        return canvas, top, bottom
+
+    def _composite(self, canvas, source, mode, top, bottom):
+        """Paste source into a caption canvas and draw everything that overlaps it."""
+        width, height = source.size
+        top_text_height = top.height
+        canvas.paste(source, (0, top_text_height))
+
         if self.separator_line:
+            draw = ImageDraw.Draw(canvas)
+            fill = self._canvas_color(self.separator_line_color, mode)
             line_y = top_text_height - 1
-            draw.line([(0, line_y), (self.width, line_y)], fill=self.separator_line_color, width=2)
-        
-        top_text_pos = self._get_text_position(wrapped_top_text)
-        
-#        draw.multiline_text(
-#            top_text_pos,
-#            wrapped_top_text,
-#            fill=self.top_font_color,
-#            font=self.font,
-#            align="center",
-#            spacing=4
-#        )
+            draw.line([(0, line_y), (width, line_y)], fill=fill, width=2)
+            if bottom and self.bottom_text_box:
+                line_y = top_text_height + height
+                draw.line([(0, line_y), (width, line_y)], fill=fill, width=2)
 
-        self._draw_text_with_style(
-            draw,
-            top_text_pos,
-            wrapped_top_text,
-            fill=self.top_font_color,
-            align="center",
-            spacing=4
-        )
-        
-        if self.bottom_text and wrapped_bottom_text:
-            if self.bottom_text_box:
-                # Draw bottom background if specified
-                if self.bottom_background_color:
-                    bottom_bg_y = top_text_height + self.height
-                    draw.rectangle(
-                        [(0, bottom_bg_y), (self.width, bottom_bg_y + bottom_text_height)],
-                        fill=self.bottom_background_color
-                    )
-                
-                bottom_text_pos = self._get_text_position_bottom(wrapped_bottom_text, top_text_height + self.height)
-                
-#                draw.multiline_text(
-#                    bottom_text_pos,
-#                    wrapped_bottom_text,
-#                    fill=self.bottom_font_color,
-#                    font=self.font,
-#                    align="center",
-#                    spacing=4
-#                )
-
-                self._draw_text_with_style(
-                    draw,
-                    bottom_text_pos,
-                    wrapped_bottom_text,
-                    fill=self.top_font_color,
-                    align="center",
-                    spacing=4
-                )
-                
-                if self.separator_line:
-                    line_y = top_text_height + self.height
-                    draw.line([(0, line_y), (self.width, line_y)], fill=self.separator_line_color, width=2)
-            else:
-                overlay_text_pos = self._get_text_position_bottom_overlay(wrapped_bottom_text)
-                adjusted_y = overlay_text_pos[1] + top_text_height
-                
-#                draw.multiline_text(
-#                    (overlay_text_pos[0], adjusted_y),
-#                    wrapped_bottom_text,
-#                    fill=self.bottom_font_color,
-#                    font=self.font,
-#                    align="center",
-#                    spacing=4
-#                )
-
-                self._draw_text_with_style(
-                    draw,
-                    (overlay_text_pos[0], adjusted_y),
-                    wrapped_bottom_text,
-                    fill=self.bottom_font_color,
-                    align="center",
-                    spacing=4
-                )
-        
-        return canvas
+        if bottom and not self.bottom_text_box:
+            overlay_text_pos = self._get_text_position_bottom_overlay(bottom, height)
+            adjusted_y = overlay_text_pos[1] + top_text_height
 
-    def to_buffer(self, format="JPEG", max_size=None):
-        """Generate captioned image and return (buffer, extension)."""
+            self._draw_text_with_style(
+                canvas,
+                (overlay_text_pos[0], adjusted_y),
+                bottom,
+                fill=self._canvas_color(self.bottom_font_color, mode)
+            )
+
+    def to_buffer(self, format="JPEG", max_size=None, compress_level=1, quality=90, **save_options):
+        """
+        Generate captioned image and return (buffer, extension).
+
+        Args:
+            format: "PNG" for PNG output, anything else JPEG (animated GIFs stay GIF)
+            max_size: Optional maximum buffer size in bytes
+            compress_level: PNG zlib level (0-9); low levels encode much faster
+            quality: JPEG quality (1-95)
+            **save_options: Extra encoder options passed to PIL for still images
+                (JPEG defaults to a single pass: optimize=False, progressive=False;
+                optimize/progressive shrink the file a few percent but encode
+                several times slower)
+        """
         if self._is_animated_gif():
             buffer = self.generate_gif()
             ext = "gif"
@@ -544,12 +819,16 @@ class Caption:
             return buffer, ext
         else:
             captioned_image = self.generate()
+            encoded_image = captioned_image
             buffer = io.BytesIO()
+            if format.upper() != 'PNG':
+                save_options.setdefault('optimize', False)
+                save_options.setdefault('progressive', False)
             
             # Determine actual format based on image and input
             if format.upper() == 'PNG':
                 # Save as PNG first
-                captioned_image.save(buffer, format='PNG')
+                captioned_image.save(buffer, format='PNG', compress_level=compress_level, **save_options)
                 ext = 'png'
             else:
                 # Default to JPEG
@@ -560,29 +839,44 @@ class Caption:
                         rgb_image.paste(captioned_image, mask=captioned_image.split()[3])
                     else:
                         rgb_image.paste(captioned_image)
-                    rgb_image.save(buffer, format='JPEG', quality=95)
+                    rgb_image.save(buffer, format='JPEG', quality=quality, **save_options)
+                    encoded_image = rgb_image
                 else:
-                    captioned_image.save(buffer, format='JPEG', quality=95)
+                    captioned_image.save(buffer, format='JPEG', quality=quality, **save_options)
                 ext = 'jpg'
             
+            size = buffer.tell()
             buffer.seek(0)
             
-            # Compress if needed
-            if max_size:
+            # Compress if needed, starting from the image still in memory
+            # instead of decoding the buffer we just wrote
+            if max_size and size > max_size:
                 # Pass the actual format for compression
                 original_format = 'PNG' if ext == 'png' else 'JPEG'
-                buffer = self.compress_to_size(buffer, max_size, original_format)
+                buffer = self.compress_to_size(encoded_image, max_size, original_format)
             
             return buffer, ext
 
 
     def close(self):
         """Close the underlying PIL Image to free memory."""
+        self._rendered = None
+        self._converted = None
         if hasattr(self, 'image'):
             self.image.close()
     
-    def save(self, output_path, max_size=None):
-        """Generate and save the captioned image."""
+    def save(self, output_path, max_size=None, quality=85, compress_level=1, **save_options):
+        """
+        Generate and save the captioned image.
+
+        Args:
+            output_path: Destination file; a .png extension saves PNG, anything else JPEG
+            max_size: Optional maximum file size in bytes
+            quality: JPEG quality (1-95)
+            compress_level: PNG zlib level (0-9); low levels encode much faster
+            **save_options: Extra encoder options passed to PIL for still images
+                (JPEG defaults to a single pass: optimize=False, progressive=False)
+        """
         if self._is_animated_gif():
             gif_buffer = self.generate_gif()
             
@@ -595,15 +889,19 @@ class Caption:
                 f.write(gif_buffer.getvalue())
         else:
             captioned_image = self.generate()
+            if not output_path.lower().endswith('.png'):
+                save_options.setdefault('optimize', False)
+                save_options.setdefault('progressive', False)
             
             # Compress if needed
             if max_size:
                 buffer = io.BytesIO()
+                encoded_image = captioned_image
                 
                 # Determine format from file extension
                 if output_path.lower().endswith('.png'):
                     # Save as PNG first
-                    captioned_image.save(buffer, format='PNG')
+                    captioned_image.save(buffer, format='PNG', compress_level=compress_level, **save_options)
                     original_format = 'PNG'
                 else:
                     # Save as JPEG (default)
@@ -614,23 +912,23 @@ class Caption:
                             rgb_image.paste(captioned_image, mask=captioned_image.split()[3])
                         else:
                             rgb_image.paste(captioned_image)
-                        rgb_image.save(buffer, format='JPEG', quality=95)
+                        rgb_image.save(buffer, format='JPEG', quality=quality, **save_options)
+                        encoded_image = rgb_image
                     else:
-                        captioned_image.save(buffer, format='JPEG', quality=95)
+                        captioned_image.save(buffer, format='JPEG', quality=quality, **save_options)
                     original_format = 'JPEG'
                 
-                buffer.seek(0)
-                
-                # Compress
-                compressed = self.compress_to_size(buffer, max_size, original_format)
+                # Compress if it doesn't fit, from the image still in memory
+                if buffer.tell() > max_size:
+                    buffer = self.compress_to_size(encoded_image, max_size, original_format)
                 
-                # Write compressed buffer directly to file
+                # Write buffer directly to file
                 with open(output_path, 'wb') as f:
-                    f.write(compressed.getvalue())
+                    f.write(buffer.getvalue())
             else:
                 # No compression, save directly
                 if output_path.lower().endswith('.png'):
-                    captioned_image.save(output_path, format='PNG')
+                    captioned_image.save(output_path, format='PNG', compress_level=compress_level, **save_options)
                 else:
                     if captioned_image.mode in ('RGBA', 'LA', 'P'):
                         # Convert to RGB for JPEG with white background
@@ -639,8 +937,8 @@ class Caption:
                             rgb_image.paste(captioned_image, mask=captioned_image.split()[3])
                         else:
                             rgb_image.paste(captioned_image)
-                        rgb_image.save(output_path, format='JPEG', quality=95)
+                        rgb_image.save(output_path, format='JPEG', quality=quality, **save_options)
                     else:
-                        captioned_image.save(output_path, format='JPEG', quality=95)
+                        captioned_image.save(output_path, format='JPEG', quality=quality, **save_options)
         
         return output_path
\ No newline at end of file
@@ -30,16 +30,27 @@ def get_top_left_corner(lines, font, img_width):
 def text_wrap(text, font, max_width):
     lines = []
     words = text.split(' ')
-    i = 0
-    while i < len(words):
-        line = ''
-        while i < len(words) and get_text_dimensions(line + words[i], font)[0] < max_width - WIDTH_PADDING:
-            line = line + words[i] + " "
-            i += 1
-        if not line:
-            line = words[i]
-            i += 1
-        lines.append(line.strip())
+    limit = max_width - WIDTH_PADDING
+    # Measure each word once and add up advances instead of re-measuring
+    # the whole line every time a word is appended. Summed advances aren't
+    # the ink bbox of the joined line, so breaks can land a word earlier or
+    # later than the old getbbox check did.
+    space_w = font.getlength(' ')
+    word_w = {}
+    line = []
+    line_w = 0
+    for word in words:
+        if word not in word_w:
+            word_w[word] = font.getlength(word)
+        w = word_w[word]
+        if line and line_w + w >= limit:
+            lines.append(' '.join(line).strip())
+            line = []
+            line_w = 0
+        line.append(word)
+        line_w += w + space_w
+    if line:
+        lines.append(' '.join(line).strip())
     return '\n'.join(lines)
 
 def get_white_space_height(lines, font):